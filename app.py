@@ -1,25 +1,28 @@
 import os
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Literal, Tuple
 from urllib import request
-from urllib.parse import quote
-from starlette.concurrency import iterate_in_threadpool
+from urllib.parse import quote, urlencode
 
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
 from loguru import logger
 from dotenv import load_dotenv
 import jwt
 from jwt import ExpiredSignatureError, InvalidTokenError
+from cachetools import TTLCache
 from utils import JWTAuth
 
-from azure.storage.blob import (
-    generate_blob_sas,
-    BlobSasPermissions,
-    BlobServiceClient
-)
+from azure.storage.blob import BlobServiceClient
 
 load_dotenv(override=False)
 
@@ -33,8 +36,31 @@ except Exception:
     JWT_PUBLIC_KEY = None
 auth = JWTAuth(public_key=JWT_PUBLIC_KEY)
 
+
+def parse_conn_str(conn_str: str):
+    parts = {}
+    for p in conn_str.split(";"):
+        k, sep, v = p.partition("=")
+        if k and sep:
+            parts[k] = v
+    return parts["AccountName"], parts["AccountKey"], parts.get("EndpointSuffix", "core.windows.net")
+
+
+# 连接串启动后不会变化：只解析一次，所有 blob client 均从同一个 BLOB_SERVICE 派生（共享连接池）
+ACCOUNT_NAME, ACCOUNT_KEY, ENDPOINT_SUFFIX = parse_conn_str(CONNECTION_STRING)
 BLOB_SERVICE = BlobServiceClient.from_connection_string(CONNECTION_STRING)
 
+# SAS 签名上下文：account key 只 base64 解码一次，签名时直接走 HMAC-SHA256
+SAS_VERSION = "2022-11-02"
+SIGNING_KEY = base64.b64decode(ACCOUNT_KEY)
+
+# blob 存在性缓存：存在的结果缓存较久；不存在的只缓存很短时间，让新上传的文件尽快可见
+BLOB_EXISTS_TTL = int(os.getenv("BLOB_EXISTS_TTL", "60"))
+BLOB_MISSING_TTL = int(os.getenv("BLOB_MISSING_TTL", "5"))
+_exists_cache = TTLCache(maxsize=50_000, ttl=BLOB_EXISTS_TTL)
+_missing_cache = TTLCache(maxsize=50_000, ttl=BLOB_MISSING_TTL)
+_exists_lock = threading.Lock()
+
 # 1) 把 .env 里的三个容器读出来
 CONTAINER_MAP = {
     "cn": os.getenv("AZURE_BLOB_CONTAINER_CN", "reports-cn"),
@@ -67,11 +93,14 @@ CERT_CONTAINER_NAME = CERT_CONTAINER_MAP[APP_REGION]
 # ----------------------------
 app = FastAPI(title="SAS Link Service", version="1.0.0")
 
-# CORS (adjust origins as needed)
+# CORS：CORS_ORIGINS 为逗号分隔的来源列表，不配置则允许任意来源。
+# 鉴权走 Authentication 请求头而非 cookie，不需要 credentials；
+# 关闭后 "*" 可以直接返回静态的 Access-Control-Allow-Origin，无需逐请求回显 Origin。
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()] or ["*"]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=CORS_ORIGINS,
+    allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
 )
@@ -83,10 +112,12 @@ logger.add(
     os.path.join(LOG_DIR, "app_{time:YYYY-MM-DD}.log"),
     rotation="00:00",
     retention="14 days",
-    enqueue=True,  # process-safe for multiple workers
+    # 每个 worker 进程各自 import app 并添加 sink，enqueue 的跨进程队列在这里没有收益，
+    # 反而给每条日志增加 pickle + 队列开销；需要时可用 LOG_ENQUEUE=1 打开
+    enqueue=os.getenv("LOG_ENQUEUE", "0") == "1",
     backtrace=False,
     diagnose=False,
-    level=os.getenv("LOG_LEVEL", "INFO"),
+    level=os.getenv("LOG_LEVEL", "WARNING"),
     format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level} | {process} | {message}",
 )
 
@@ -98,11 +129,46 @@ class ApiResponse(BaseModel):
     data: Optional[Any] = None
 
 
-def parse_conn_str(conn_str: str):
-    parts = dict(p.split("=", 1) for p in conn_str.split(";") if "=" in p)
-    return parts["AccountName"], parts["AccountKey"], parts.get("EndpointSuffix", "core.windows.net")
+# 固定结构的错误响应：启动时序列化好，处理请求时直接返回 bytes，跳过模型校验与 JSON 编码
+@lru_cache(maxsize=32)
+def _error_body(message: str) -> bytes:
+    return json.dumps({"code": 0, "message": message, "data": None}, separators=(",", ":")).encode("utf-8")
+
+
+NOT_FOUND_BODY = _error_body("Not Found")
+NOT_LISTED_BODY = _error_body("Not Listed")
+INTERNAL_ERROR_BODY = _error_body("Internal Server Error")
+# 鉴权失败的消息（JWTAuth 抛出的 ValueError）：_error_body(str(e)) 直接命中缓存
+MISSING_JWT_BODY = _error_body("Missing JWT")
+INVALID_TOKEN_BODY = _error_body("Invalid token.")
+JWT_UNAVAILABLE_BODY = _error_body("JWT verification not available")
+
+
+def _json_bytes_response(body: bytes, status_code: int = 200) -> Response:
+    return Response(content=body, media_type="application/json", status_code=status_code)
+
+
+class SasBatchItem(BaseModel):
+    kind: Literal["report", "certificate"]
+    region: Optional[str] = None       # cn / hk / en
+    view: Optional[str] = None         # inline / attachment
 
 
+class SasBatchRequest(BaseModel):
+    character_id: str
+    # 每种 kind 最多一项：上限即支持的 kind 数量
+    items: List[SasBatchItem] = Field(min_length=1, max_length=2)
+
+    @field_validator("items")
+    @classmethod
+    def _unique_kinds(cls, items: List[SasBatchItem]) -> List[SasBatchItem]:
+        kinds = [item.kind for item in items]
+        if len(set(kinds)) != len(kinds):
+            raise ValueError("duplicate kind in items")
+        return items
+
+
+@lru_cache(maxsize=50_000)
 def resolve_blob_name(character_id: str) -> Optional[str]:
     """Map a character_id to a blob path.
     Replace this with a DB/query as needed. Here we assume <character_id>.pdf inside DEFAULT_CONTAINER.
@@ -110,13 +176,123 @@ def resolve_blob_name(character_id: str) -> Optional[str]:
     # Example rule-based mapping
     return f"{character_id}.pdf"
 
+
+# ASCII 兜底文件名放在 quoted-string 里：去掉双引号、反斜杠和控制字符，避免 header 格式被破坏
+_CD_UNSAFE = dict.fromkeys([*range(0x20), 0x7F, ord('"'), ord('\\')])
+
+
+@lru_cache(maxsize=50_000)
+def _cd_header(disp: str, basename: str) -> str:
+    """Content-Disposition（RFC 5987）：ASCII 兜底文件名 + UTF-8 编码的真实文件名。
+
+    该值会作为 rscd 签进 SAS，两个固定文件名的结果：
+
+    >>> print(_cd_header("attachment", "LifeReport.pdf"))
+    attachment; filename="LifeReport.pdf"; filename*=UTF-8''LifeReport.pdf
+    >>> print(_cd_header("inline", "Certificate.png"))
+    inline; filename="Certificate.png"; filename*=UTF-8''Certificate.png
+    >>> print(_cd_header("attachment", 'a"b\\\\c\\r\\n.pdf'))
+    attachment; filename="abc.pdf"; filename*=UTF-8''a%22b%5Cc%0D%0A.pdf
+    """
+    ascii_fallback = basename.encode('ascii', 'ignore').decode('ascii').translate(_CD_UNSAFE) or 'report.pdf'
+    return f'{disp}; filename="{ascii_fallback}"; filename*=UTF-8\'\'{quote(basename, safe="")}'
+
+
+@lru_cache(maxsize=4)
+def _sas_window(now: int) -> Tuple[str, str]:
+    """按整秒缓存 SAS 的 (start, expiry) ISO 字符串；start 向前留 5 分钟容忍时钟偏差。"""
+    start_iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now - 5 * 60))
+    expiry_iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now + SAS_TTL_MIN * 60))
+    return start_iso, expiry_iso
+
+
+def _sign_blob_sas(
+    container: str,
+    blob: str,
+    expiry_iso: str,
+    start_iso: str,
+    rscd: str,
+    rsct: str,
+) -> str:
+    """生成只读、仅 https 的 blob SAS 查询串（等价于 generate_blob_sas 的输出）。
+
+    string-to-sign 按 Azure Service SAS 2020-12-06 及以后版本的格式拼接，
+    字段顺序必须与文档一致，未使用的字段留空。
+    """
+    string_to_sign = (
+        f"r\n"                                           # signedPermissions
+        f"{start_iso}\n"
+        f"{expiry_iso}\n"
+        f"/blob/{ACCOUNT_NAME}/{container}/{blob}\n"     # canonicalizedResource
+        f"\n"                                            # signedIdentifier
+        f"\n"                                            # signedIP
+        f"https\n"                                       # signedProtocol
+        f"{SAS_VERSION}\n"
+        f"b\n"                                           # signedResource
+        f"\n"                                            # signedSnapshotTime
+        f"\n"                                            # signedEncryptionScope
+        f"\n"                                            # rscc
+        f"{rscd}\n"
+        f"\n"                                            # rsce
+        f"\n"                                            # rscl
+        f"{rsct}"
+    )
+    sig = base64.b64encode(
+        hmac.new(SIGNING_KEY, string_to_sign.encode("utf-8"), hashlib.sha256).digest()
+    ).decode("utf-8")
+    return urlencode(
+        {
+            "st": start_iso,
+            "se": expiry_iso,
+            "sp": "r",
+            "spr": "https",
+            "sv": SAS_VERSION,
+            "sr": "b",
+            "rscd": rscd,
+            "rsct": rsct,
+            "sig": sig,
+        },
+        quote_via=quote,
+    )
+
+
+def _cached_blob_exists(key) -> Optional[bool]:
+    with _exists_lock:
+        if key in _exists_cache:
+            return True
+        if key in _missing_cache:
+            return False
+    return None
+
+
 def blob_exists(container_name: str, blob_name: str) -> bool:
+    key = (container_name, blob_name)
+    cached = _cached_blob_exists(key)
+    if cached is not None:
+        return cached
+
     try:
         bc = BLOB_SERVICE.get_blob_client(container=container_name, blob=blob_name)
-        return bc.exists()  # SDK 自带 exists()
+        exists = bc.exists()  # SDK 自带 exists()
     except Exception:
+        # 网络/权限异常不缓存，下次请求重新检查
         return False
 
+    with _exists_lock:
+        if exists:
+            _exists_cache[key] = True
+        else:
+            _missing_cache[key] = True
+    return exists
+
+
+async def blob_exists_async(container_name: str, blob_name: str) -> bool:
+    """在 async 接口中使用：缓存命中直接返回，否则把同步的 Azure 调用放到线程池，避免阻塞事件循环。"""
+    cached = _cached_blob_exists((container_name, blob_name))
+    if cached is not None:
+        return cached
+    return await asyncio.to_thread(blob_exists, container_name, blob_name)
+
 async def build_sas_url(
     character_id: str,
     *,
@@ -127,7 +303,6 @@ async def build_sas_url(
     blob_name_override: Optional[str] = None # ✅ 新增：可自定义 blob 名
 ) -> str:
 
-    account_name, account_key, endpoint_suffix = parse_conn_str(CONNECTION_STRING)
     container = container_name or CONTAINER_NAME
 
     blob_name = blob_name_override or resolve_blob_name(character_id)
@@ -142,36 +317,27 @@ async def build_sas_url(
     # 文件名（默认取 blob basename）
     basename = filename or os.path.basename(blob_name)
 
-    # 注意：这里 filename 放在 header 里需要做 URL 编码，
+    # 注意：filename 放在 header 里需要编码，
     # 以避免空格/中文/特殊字符导致的 header 格式问题。
-    encoded_filename = quote(basename)
-
-    now = datetime.utcnow()
-    start = now - timedelta(minutes=5)
-    expiry = now + timedelta(minutes=SAS_TTL_MIN)
-
-    sas = generate_blob_sas(
-        account_name=account_name,
-        container_name=container,
-        blob_name=blob_name,
-        account_key=account_key,
-        permission=BlobSasPermissions(read=True),
-        expiry=expiry,
-        start=start,
-        protocol="https",
-        # 下面两个参数会在 SAS 中产生 rscd / rsct，
-        # 且在响应时覆盖 Content-Disposition / Content-Type。
-        content_disposition=f'{disp}; filename="{encoded_filename}"',
-        content_type=content_type,
+    content_disposition = _cd_header(disp, basename)
+
+    start_iso, expiry_iso = _sas_window(int(time.time()))
+
+    # rscd / rsct 会在响应时覆盖 Content-Disposition / Content-Type。
+    sas = _sign_blob_sas(
+        container,
+        blob_name,
+        expiry_iso=expiry_iso,
+        start_iso=start_iso,
+        rscd=content_disposition,
+        rsct=content_type,
     )
 
-    url = f"https://{account_name}.blob.{endpoint_suffix}/{container}/{blob_name}?{sas}"
-    logger.info(f"build_sas_url: character_id={character_id}, view={view}, container={container_name}")
-    from urllib.parse import quote as urlquote
-    ascii_fallback = basename.encode('ascii', 'ignore').decode('ascii') or 'report.pdf'
-    # content_disposition = f'{disp}; filename="{ascii_fallback}"; filename*=UTF-8\'\'{urlquote(basename, safe="")}'
-    content_disposition = f'{disp}; filename="{ascii_fallback}"; filename*=UTF-8\'\'{urlquote(basename, safe="")}'
-    logger.info(f"SAS override headers going to Azure: Content-Disposition='{content_disposition}', Content-Type='{content_type}'")
+    url = f"https://{ACCOUNT_NAME}.blob.{ENDPOINT_SUFFIX}/{container}/{blob_name}?{sas}"
+    logger.info(
+        "build_sas_url: character_id={}, view={}, container={}, rscd='{}', rsct='{}'",
+        character_id, view, container, content_disposition, content_type,
+    )
     return url
 
 
@@ -180,28 +346,23 @@ async def build_sas_url(
 async def log_requests(request: Request, call_next):
     try:
         client = request.client.host if request.client else "-"
-        logger.info(f"REQ {request.method} {request.url.path} | client={client} | query={dict(request.query_params)}")
+        # 位置参数只在日志级别生效时才格式化；query_params 原样传入，低于 INFO 时不会被序列化
+        logger.info(
+            "REQ {} {} | client={} | query={}",
+            request.method, request.url.path, client, request.query_params,
+        )
 
         response = await call_next(request)
 
-        try:
-            body = b""
-            async for chunk in response.body_iterator:
-                body += chunk
-
-            payload = body.decode("utf-8", "ignore") if body else ""
-            logger.info(
-                f"RESP {request.method} {request.url.path} | status={response.status_code} | body={payload[:500]}"
-            )
-            response.body_iterator = iterate_in_threadpool(iter([body]))
-        except Exception:
-            logger.info(f"RESP {request.method} {request.url.path} | status={response.status_code}")
+        # 不再回放响应体：只记录状态码和长度，避免每个请求多一次完整拷贝和线程池切换
+        length = response.headers.get("content-length", "-")
+        logger.info("RESP {} {} | status={} | length={}", request.method, request.url.path, response.status_code, length)
 
         return response
 
     except Exception as e:
         logger.exception(f"Unhandled error in middleware: {e}")
-        return JSONResponse(status_code=500, content=ApiResponse(code=0, message="Internal Server Error").dict())
+        return _json_bytes_response(INTERNAL_ERROR_BODY, status_code=500)
 
 
 @app.get("/health", response_model=ApiResponse)
@@ -234,10 +395,7 @@ async def get_report_sas(
         _ = auth.verify_and_match(request, character_id)
     except ValueError as e:
         print(f"Auth failed: {e}")
-        return JSONResponse(
-            status_code=401,
-            content=ApiResponse(code=0, message=str(e)).dict()
-        )
+        return _json_bytes_response(_error_body(str(e)), status_code=401)
 
     try:
         container_name = container
@@ -251,15 +409,18 @@ async def get_report_sas(
         if view_mode not in ("inline", "attachment"):
             view_mode = "attachment"
 
-        logger.info(f"get_sas resolved -> view_mode={view_mode!r}, container_name={container_name!r}, filename={filename!r}")
+        logger.info(
+            "get_sas resolved -> view_mode={!r}, container_name={!r}, filename={!r}",
+            view_mode, container_name, filename,
+        )
 
         blob_name = resolve_blob_name(character_id)
-        if not blob_exists(container_name, blob_name):
+        if not await blob_exists_async(container_name, blob_name):
             # return JSONResponse(
             #     status_code=404,
             #     content=ApiResponse(code=0, message="Not Found").dict()
             # )
-            return ApiResponse(code=0, message="Not Listed", data=None)
+            return _json_bytes_response(NOT_LISTED_BODY)
 
         url = await build_sas_url(
             character_id,
@@ -298,10 +459,7 @@ async def get_certificate_sas(
         _ = auth.verify_and_match(request, character_id)
     except ValueError as e:
         print(f"Auth failed: {e}")
-        return JSONResponse(
-            status_code=401,
-            content=ApiResponse(code=0, message=str(e)).dict()
-        )
+        return _json_bytes_response(_error_body(str(e)), status_code=401)
 
     try:
         # 选择容器：优先 container 参数，其次 region 对应的证书容器，最后用默认证书容器
@@ -318,17 +476,20 @@ async def get_certificate_sas(
         if view_mode not in ("inline", "attachment"):
             view_mode = "attachment"
 
-        logger.info(f"get_certificate_sas -> view_mode={view_mode!r}, container_name={container_name!r}, filename={filename!r}")
+        logger.info(
+            "get_certificate_sas -> view_mode={!r}, container_name={!r}, filename={!r}",
+            view_mode, container_name, filename,
+        )
 
         # 证书固定是 PNG：blob 名形如 <char_id>.png
         png_blob_name = f"{character_id}.png"
 
-        if not blob_exists(container_name, png_blob_name):
+        if not await blob_exists_async(container_name, png_blob_name):
             # return JSONResponse(
             #     status_code=404,
             #     content=ApiResponse(code=0, message="Not Found").dict()
             # )
-            return ApiResponse(code=0, message="Not Listed", data=None)
+            return _json_bytes_response(NOT_LISTED_BODY)
 
         url = await build_sas_url(
             character_id,
@@ -346,14 +507,78 @@ async def get_certificate_sas(
         logger.exception(f"Certificate SAS generation failed for character_id={character_id}: {e}")
         return ApiResponse(code=0, message="Failed to generate certificate SAS link")
 
+@app.post("/sas/batch", response_model=ApiResponse)
+async def get_batch_sas(request: Request, body: SasBatchRequest) -> ApiResponse:
+    """
+    一次请求返回同一角色的多个 SAS url（例如报告 + 证书），只做一次 JWT 校验，
+    存在性检查与签名并发执行。
+
+    items 中每种 kind（report / certificate）最多出现一次，重复或不支持的 kind 返回 422。
+    文件名与单项接口一致，固定为 LifeReport.pdf / Certificate.png。
+    data 为 {kind: url}，blob 不存在时对应值为 null。
+    """
+    character_id = body.character_id
+    try:
+        _ = auth.verify_and_match(request, character_id)
+    except ValueError as e:
+        logger.warning("Auth failed: {}", e)
+        return _json_bytes_response(_error_body(str(e)), status_code=401)
+
+    try:
+        targets = []
+        for item in body.items:
+            view_mode = (item.view or "attachment").lower()
+            if view_mode not in ("inline", "attachment"):
+                view_mode = "attachment"
+
+            region = item.region.lower() if item.region else None
+            if item.kind == "report":
+                container_name = CONTAINER_MAP.get(region) or CONTAINER_NAME
+                blob_name = resolve_blob_name(character_id)
+                filename = "LifeReport.pdf"
+                content_type = "application/pdf"
+            else:
+                container_name = CERT_CONTAINER_MAP.get(region) or CERT_CONTAINER_NAME
+                blob_name = f"{character_id}.png"
+                filename = "Certificate.png"
+                content_type = "image/png"
+            targets.append((item.kind, container_name, blob_name, view_mode, filename, content_type))
+
+        logger.info("get_batch_sas -> character_id={}, items={}", character_id, targets)
+
+        exists = await asyncio.gather(*[blob_exists_async(t[1], t[2]) for t in targets])
+        urls = await asyncio.gather(*[
+            build_sas_url(
+                character_id,
+                container_name=container_name,
+                view=view_mode,
+                filename=filename,
+                content_type=content_type,
+                blob_name_override=blob_name,
+            )
+            for (_, container_name, blob_name, view_mode, filename, content_type), ok in zip(targets, exists)
+            if ok
+        ])
+
+        data: Dict[str, Optional[str]] = {}
+        found = iter(urls)
+        for (kind, *_), ok in zip(targets, exists):
+            data[kind] = next(found) if ok else None
+        return ApiResponse(code=1, message="Success", data=data)
+
+    except Exception as e:
+        logger.exception(f"Batch SAS generation failed for character_id={character_id}: {e}")
+        return ApiResponse(code=0, message="Failed to generate SAS links")
+
+
 @app.exception_handler(404)
 async def not_found_handler(request: Request, exc):
-    return JSONResponse(status_code=404, content=ApiResponse(code=0, message="Not Found").dict())
+    return _json_bytes_response(NOT_FOUND_BODY, status_code=404)
 
 
 @app.exception_handler(500)
 async def internal_error_handler(request: Request, exc):
-    return JSONResponse(status_code=500, content=ApiResponse(code=0, message="Internal Server Error").dict())
+    return _json_bytes_response(INTERNAL_ERROR_BODY, status_code=500)
 
 
 if __name__ == "__main__":
@@ -363,6 +588,9 @@ if __name__ == "__main__":
         "app:app",
         host="0.0.0.0",
         port=int(os.getenv("PORT", "8001")),
-        reload=True,
-        workers=1,
+        # auto：安装了 uvicorn[standard] 时使用 uvloop + httptools；缓存均为进程内，各 worker 独立
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        loop="auto",
+        http="auto",
+        reload=False,
     )
@@ -1,5 +1,10 @@
 import os
+import hashlib
+import threading
+import time
 from typing import Optional, Dict, Any
+from cachetools import TTLCache
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
 from fastapi import Request
 from loguru import logger
 from dotenv import load_dotenv
@@ -7,8 +12,19 @@ import jwt
 
 
 class JWTAuth:
-    def __init__(self, public_key: Optional[str]):
+    def __init__(self, public_key: Optional[str], cache_size: int = 10000, cache_ttl: int = 30):
         self.public_key = public_key
+        # 启动时把 PEM 解析成公钥对象，避免 jwt.decode 每次调用都重新解析 PEM/ASN.1
+        self._pubkey = None
+        if public_key:
+            try:
+                pem = public_key.encode("utf-8") if isinstance(public_key, str) else public_key
+                self._pubkey = load_pem_public_key(pem)
+            except Exception as e:
+                logger.error(f"JWT public key load error: {e}")
+        # 已验签的 claims 缓存：key 为 sha256(token)，不保存原始 token
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._cache_lock = threading.RLock()
 
     def _extract_bearer_token(self, request: Request) -> Optional[str]:
         """
@@ -33,7 +49,7 @@ class JWTAuth:
           2. token 中的 characterId 必须与 path 参数一致
           3. 解析过程中任何异常 → 拒绝
         """
-        if not self.public_key:
+        if self._pubkey is None:
             logger.error("JWT public key not configured")
             raise ValueError("JWT verification not available")
 
@@ -41,10 +57,35 @@ class JWTAuth:
         if not token:
             raise ValueError("Missing JWT")
 
+        key = hashlib.sha256(token.encode("utf-8")).digest()
+        with self._cache_lock:
+            cached = self._cache.get(key)
+        if cached is not None:
+            claims, exp = cached
+            # 命中缓存：只需重新检查过期时间和 characterId，跳过 RSA 验签
+            if exp > time.time() and str(claims.get("characterId")) == str(character_id):
+                return claims
+
+        # 先不验签地解析 payload（仅 base64 + JSON），把 characterId 不匹配 / 已过期的 token
+        # 在 RSA 验签之前拒掉；通过后仍然走下面完整的验签流程
+        try:
+            unverified = jwt.decode(token, options={"verify_signature": False})
+            unverified_exp = float(unverified["exp"])
+        except Exception as e:
+            logger.error(f"JWT decode error: {e}")
+            raise ValueError("Invalid token.")
+
+        if str(unverified.get("characterId")) != str(character_id):
+            logger.error(f"JWT decode error: {unverified.get('characterId')} != {character_id} mismatch.")
+            raise ValueError("Invalid token.")
+        if unverified_exp <= time.time():
+            logger.error("JWT decode error: Signature has expired")
+            raise ValueError("Invalid token.")
+
         try:
             claims = jwt.decode(
                 token,
-                self.public_key,
+                self._pubkey,
                 algorithms=["RS256"],
                 options={"require": ["exp", "iat"], "verify_exp": True, "verify_aud": False},
             )
@@ -62,4 +103,7 @@ class JWTAuth:
             logger.error(f"JWT decode error: {claims.get('characterId')} != {character_id} mismatch.")
             raise ValueError("Invalid token.")
 
+        with self._cache_lock:
+            self._cache[key] = (claims, claims["exp"])
+
         return claims